@@ -4,7 +4,8 @@ Uses SQLAlchemy with support for PostgreSQL (production) or SQLite (development)
 """
 
 from sqlalchemy import (
-    create_engine,
+    select,
+    text,
     Column,
     Integer,
     String,
@@ -14,15 +15,19 @@ from sqlalchemy import (
     ForeignKey,
     Date,
     UniqueConstraint,
+    Index,
     Float,
     Enum as SQLEnum,
 )
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import relationship
 from datetime import datetime, date, timezone
 from enum import Enum
 import os
 
+from security import hash_password
+
 
 # ============== Subscription Enums ==============
 class SubscriptionTier(str, Enum):
@@ -75,6 +80,11 @@ SUBSCRIPTION_LIMITS = {
     },
 }
 
+# Daily sentence limit per tier (-1 = unlimited), flattened for per-request checks
+DAILY_SENTENCE_LIMITS = {
+    tier: limits["daily_sentences"] for tier, limits in SUBSCRIPTION_LIMITS.items()
+}
+
 # Database URL - PostgreSQL for production
 # IMPORTANT: Using psycopg3 driver (postgresql+psycopg) to fix Windows Unicode issues
 #
@@ -96,19 +106,34 @@ if DATABASE_URL.startswith("postgres://"):
 elif DATABASE_URL.startswith("postgresql://") and "+psycopg" not in DATABASE_URL:
     DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+psycopg://", 1)
 
+# The engine is asyncio-based: psycopg3 supports both modes under the same URL,
+# SQLite (local development) needs the aiosqlite driver
+if DATABASE_URL.startswith("sqlite://"):
+    DATABASE_URL = DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
+
 print(f"🐘 Connecting to PostgreSQL: {DATABASE_URL.split('@')[-1]}")
 
-# Create engine with connection pooling for production scale
-engine = create_engine(
-    DATABASE_URL,
-    pool_size=20,  # Number of persistent connections
-    max_overflow=30,  # Extra connections when needed
-    pool_pre_ping=True,  # Verify connections before use
-    pool_recycle=3600,  # Recycle connections after 1 hour
-)
+# Engine options with connection pooling for production scale
+ENGINE_OPTIONS = {
+    "pool_pre_ping": True,  # Verify connections before use
+    "pool_recycle": 1800,  # Recycle connections after 30 minutes
+    "query_cache_size": 1200,  # Compiled SQL cache entries (default 500)
+}
+if not DATABASE_URL.startswith("sqlite"):
+    # aiosqlite runs on NullPool, which takes no sizing options.
+    # Each worker process has its own pool, so the server can open up to
+    # workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections; keep that under
+    # PostgreSQL's max_connections (100 by default). The Dockerfile runs 4 workers.
+    ENGINE_OPTIONS["pool_size"] = int(os.getenv("DB_POOL_SIZE", "10"))
+    ENGINE_OPTIONS["max_overflow"] = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    # Fail fast with an error instead of queueing indefinitely when saturated
+    ENGINE_OPTIONS["pool_timeout"] = int(os.getenv("DB_POOL_TIMEOUT", "5"))
+
+engine = create_async_engine(DATABASE_URL, **ENGINE_OPTIONS)
 
 # Session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: async sessions cannot lazily reload expired attributes
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
 
 # Base class for models
 Base = declarative_base()
@@ -147,29 +172,27 @@ class User(Base):
     sentences = relationship(
         "Sentence", back_populates="owner", cascade="all, delete-orphan"
     )
+    streak = relationship(
+        "DailyStreak",
+        back_populates="user",
+        uselist=False,
+        cascade="all, delete-orphan",
+    )
 
     @property
     def is_premium(self):
         """Check if user has active premium subscription"""
-        if self.lifetime_member:
-            return True
-        if self.subscription_tier == SubscriptionTier.FREE.value:
-            return False
-        if (
-            self.subscription_expires_at
-            and self.subscription_expires_at > datetime.now(timezone.utc)
-        ):
-            return True
-        return False
+        return self.current_tier != SubscriptionTier.FREE
 
     @property
     def current_tier(self):
         """Get current subscription tier"""
         if self.lifetime_member:
             return SubscriptionTier.LIFETIME
+        # subscription_expires_at is stored as naive UTC (see payment handlers)
         if (
             self.subscription_expires_at
-            and self.subscription_expires_at > datetime.now(timezone.utc)
+            and self.subscription_expires_at > datetime.utcnow()
         ):
             return SubscriptionTier(self.subscription_tier)
         return SubscriptionTier.FREE
@@ -188,8 +211,9 @@ class Session(Base):
     id = Column(Integer, primary_key=True, index=True)
     token = Column(String(255), unique=True, index=True, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    created_at = Column(DateTime, default=datetime.now(timezone.utc))
-    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    # Indexed so the periodic purge deletes expired rows as a range, not a table scan
+    expires_at = Column(DateTime, nullable=False, index=True)
 
     # Relationships
     user = relationship("User", back_populates="sessions")
@@ -203,7 +227,8 @@ class Post(Base):
     id = Column(Integer, primary_key=True, index=True)
     author_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     content = Column(Text, nullable=False)
-    created_at = Column(DateTime, default=datetime.now(timezone.utc))
+    # Indexed so the newest-first feed is read in index order instead of sorted
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
     likes = Column(Integer, default=0)
 
     # Relationships
@@ -221,7 +246,7 @@ class PostLike(Base):
     id = Column(Integer, primary_key=True, index=True)
     post_id = Column(Integer, ForeignKey("posts.id"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    created_at = Column(DateTime, default=datetime.now(timezone.utc))
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
     # Relationships
     post = relationship("Post", back_populates="post_likes")
@@ -241,7 +266,7 @@ class Sentence(Base):
     hint = Column(Text, nullable=True)
     difficulty = Column(Integer, default=1)  # 1=easy, 2=medium, 3=hard
     category = Column(String(50), default="general")  # weather, travel, business, etc.
-    created_at = Column(DateTime, default=datetime.now(timezone.utc))
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
     # Relationships
     owner = relationship("User", back_populates="sentences")
@@ -271,8 +296,8 @@ class PracticeRecord(Base):
     is_mastered = Column(Boolean, default=False)
     is_bookmarked = Column(Boolean, default=False)  # User saved for later
 
-    created_at = Column(DateTime, default=datetime.now(timezone.utc))
-    updated_at = Column(DateTime, default=datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc))
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
     # Relationships
     user = relationship("User", backref="practice_records")
@@ -293,7 +318,7 @@ class DailyStreak(Base):
     total_sentences_practiced = Column(Integer, default=0)
 
     # Relationships
-    user = relationship("User", backref="streak")
+    user = relationship("User", back_populates="streak")
 
 
 class Payment(Base):
@@ -324,190 +349,249 @@ class Payment(Base):
     user = relationship("User", back_populates="payments")
 
 
+class Item(Base):
+    """Catalog item"""
+
+    __tablename__ = "items"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), nullable=False)
+    description = Column(String(500), nullable=True)
+    price = Column(Float, nullable=False)
+    category = Column(String(20), nullable=False)
+    in_stock = Column(Boolean, default=True)
+    image_url = Column(String(500), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # Category filters page in id order, so both are served straight from the index
+    __table_args__ = (Index("ix_items_category_id", "category", "id"),)
+
+
 # ============== Database Utilities ==============
 
 
-def migrate_database():
-    """Run database migrations to add new columns to existing tables"""
-    from sqlalchemy import text, inspect
+def migrate_database(conn):
+    """
+    Run database migrations to add new columns to existing tables.
+    Takes a sync connection, so run it through AsyncConnection.run_sync.
+    """
+    from sqlalchemy import inspect
 
-    inspector = inspect(engine)
+    inspector = inspect(conn)
     tables = inspector.get_table_names()
 
-    with engine.connect() as conn:
-        # Migrate users table
-        if "users" in tables:
-            columns = [col["name"] for col in inspector.get_columns("users")]
+    # Migrate users table
+    if "users" in tables:
+        columns = [col["name"] for col in inspector.get_columns("users")]
 
-            if "subscription_tier" not in columns:
-                print("📦 Adding subscription_tier column to users...")
-                conn.execute(
-                    text(
-                        "ALTER TABLE users ADD COLUMN subscription_tier VARCHAR(20) DEFAULT 'free'"
-                    )
+        if "subscription_tier" not in columns:
+            print("📦 Adding subscription_tier column to users...")
+            conn.execute(
+                text(
+                    "ALTER TABLE users ADD COLUMN subscription_tier VARCHAR(20) DEFAULT 'free'"
                 )
+            )
 
-            if "subscription_expires_at" not in columns:
-                print("📦 Adding subscription_expires_at column to users...")
-                conn.execute(
-                    text(
-                        "ALTER TABLE users ADD COLUMN subscription_expires_at TIMESTAMP"
-                    )
+        if "subscription_expires_at" not in columns:
+            print("📦 Adding subscription_expires_at column to users...")
+            conn.execute(
+                text(
+                    "ALTER TABLE users ADD COLUMN subscription_expires_at TIMESTAMP"
                 )
+            )
 
-            if "lifetime_member" not in columns:
-                print("📦 Adding lifetime_member column to users...")
-                conn.execute(
-                    text(
-                        "ALTER TABLE users ADD COLUMN lifetime_member BOOLEAN DEFAULT FALSE"
-                    )
+        if "lifetime_member" not in columns:
+            print("📦 Adding lifetime_member column to users...")
+            conn.execute(
+                text(
+                    "ALTER TABLE users ADD COLUMN lifetime_member BOOLEAN DEFAULT FALSE"
                 )
+            )
 
-        # Migrate sentences table
-        if "sentences" in tables:
-            columns = [col["name"] for col in inspector.get_columns("sentences")]
+    # Migrate sentences table
+    if "sentences" in tables:
+        columns = [col["name"] for col in inspector.get_columns("sentences")]
 
-            if "user_id" not in columns:
-                print("📦 Adding user_id column to sentences...")
-                conn.execute(
-                    text(
-                        "ALTER TABLE sentences ADD COLUMN user_id INTEGER REFERENCES users(id)"
-                    )
+        if "user_id" not in columns:
+            print("📦 Adding user_id column to sentences...")
+            conn.execute(
+                text(
+                    "ALTER TABLE sentences ADD COLUMN user_id INTEGER REFERENCES users(id)"
                 )
-                conn.execute(
-                    text(
-                        "CREATE INDEX IF NOT EXISTS idx_sentences_user_id ON sentences(user_id)"
-                    )
+            )
+            conn.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS idx_sentences_user_id ON sentences(user_id)"
                 )
+            )
 
-            if "english" not in columns:
-                print("📦 Adding english column to sentences...")
-                conn.execute(text("ALTER TABLE sentences ADD COLUMN english TEXT"))
+        if "english" not in columns:
+            print("📦 Adding english column to sentences...")
+            conn.execute(text("ALTER TABLE sentences ADD COLUMN english TEXT"))
 
-            if "difficulty" not in columns:
-                print("📦 Adding difficulty column to sentences...")
-                conn.execute(
-                    text(
-                        "ALTER TABLE sentences ADD COLUMN difficulty INTEGER DEFAULT 1"
-                    )
+        if "difficulty" not in columns:
+            print("📦 Adding difficulty column to sentences...")
+            conn.execute(
+                text(
+                    "ALTER TABLE sentences ADD COLUMN difficulty INTEGER DEFAULT 1"
                 )
+            )
 
-            if "category" not in columns:
-                print("📦 Adding category column to sentences...")
-                conn.execute(
-                    text(
-                        "ALTER TABLE sentences ADD COLUMN category VARCHAR(50) DEFAULT 'general'"
-                    )
+        if "category" not in columns:
+            print("📦 Adding category column to sentences...")
+            conn.execute(
+                text(
+                    "ALTER TABLE sentences ADD COLUMN category VARCHAR(50) DEFAULT 'general'"
                 )
+            )
 
-        # Migrate practice_records table
-        if "practice_records" in tables:
-            columns = [col["name"] for col in inspector.get_columns("practice_records")]
+    # Migrate sessions table
+    if "sessions" in tables:
+        indexes = [idx["name"] for idx in inspector.get_indexes("sessions")]
 
-            if "user_answer" not in columns:
-                print("📦 Adding user_answer column to practice_records...")
-                conn.execute(
-                    text("ALTER TABLE practice_records ADD COLUMN user_answer TEXT")
+        if "ix_sessions_expires_at" not in indexes:
+            print("📦 Adding expires_at index to sessions...")
+            conn.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_sessions_expires_at ON sessions(expires_at)"
                 )
+            )
 
-            if "practice_count" not in columns:
-                print("📦 Adding practice_count column to practice_records...")
-                conn.execute(
-                    text(
-                        "ALTER TABLE practice_records ADD COLUMN practice_count INTEGER DEFAULT 1"
-                    )
-                )
+    # Migrate posts table
+    if "posts" in tables:
+        indexes = [idx["name"] for idx in inspector.get_indexes("posts")]
 
-            if "mastery_level" not in columns:
-                print("📦 Adding mastery_level column to practice_records...")
-                conn.execute(
-                    text(
-                        "ALTER TABLE practice_records ADD COLUMN mastery_level INTEGER DEFAULT 0"
-                    )
+        if "ix_posts_created_at" not in indexes:
+            print("📦 Adding created_at index to posts...")
+            conn.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_posts_created_at ON posts(created_at)"
                 )
+            )
+
+    # Migrate practice_records table
+    if "practice_records" in tables:
+        columns = [col["name"] for col in inspector.get_columns("practice_records")]
+
+        if "user_answer" not in columns:
+            print("📦 Adding user_answer column to practice_records...")
+            conn.execute(
+                text("ALTER TABLE practice_records ADD COLUMN user_answer TEXT")
+            )
+
+        if "practice_count" not in columns:
+            print("📦 Adding practice_count column to practice_records...")
+            conn.execute(
+                text(
+                    "ALTER TABLE practice_records ADD COLUMN practice_count INTEGER DEFAULT 1"
+                )
+            )
 
-            if "next_review_date" not in columns:
-                print("📦 Adding next_review_date column to practice_records...")
-                conn.execute(
-                    text(
-                        "ALTER TABLE practice_records ADD COLUMN next_review_date DATE"
-                    )
+        if "mastery_level" not in columns:
+            print("📦 Adding mastery_level column to practice_records...")
+            conn.execute(
+                text(
+                    "ALTER TABLE practice_records ADD COLUMN mastery_level INTEGER DEFAULT 0"
                 )
+            )
 
-            if "is_mastered" not in columns:
-                print("📦 Adding is_mastered column to practice_records...")
-                conn.execute(
-                    text(
-                        "ALTER TABLE practice_records ADD COLUMN is_mastered BOOLEAN DEFAULT FALSE"
-                    )
+        if "next_review_date" not in columns:
+            print("📦 Adding next_review_date column to practice_records...")
+            conn.execute(
+                text(
+                    "ALTER TABLE practice_records ADD COLUMN next_review_date DATE"
                 )
+            )
 
-            if "is_bookmarked" not in columns:
-                print("📦 Adding is_bookmarked column to practice_records...")
-                conn.execute(
-                    text(
-                        "ALTER TABLE practice_records ADD COLUMN is_bookmarked BOOLEAN DEFAULT FALSE"
-                    )
+        if "is_mastered" not in columns:
+            print("📦 Adding is_mastered column to practice_records...")
+            conn.execute(
+                text(
+                    "ALTER TABLE practice_records ADD COLUMN is_mastered BOOLEAN DEFAULT FALSE"
                 )
+            )
 
-            if "updated_at" not in columns:
-                print("📦 Adding updated_at column to practice_records...")
-                conn.execute(
-                    text(
-                        "ALTER TABLE practice_records ADD COLUMN updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP"
-                    )
+        if "is_bookmarked" not in columns:
+            print("📦 Adding is_bookmarked column to practice_records...")
+            conn.execute(
+                text(
+                    "ALTER TABLE practice_records ADD COLUMN is_bookmarked BOOLEAN DEFAULT FALSE"
                 )
+            )
 
-        conn.commit()
+        if "updated_at" not in columns:
+            print("📦 Adding updated_at column to practice_records...")
+            conn.execute(
+                text(
+                    "ALTER TABLE practice_records ADD COLUMN updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP"
+                )
+            )
 
     print("✅ Database migration check completed!")
 
 
-def create_tables():
+async def create_tables():
     """Create all database tables"""
     # First run migrations for existing tables
     try:
-        migrate_database()
+        async with engine.begin() as conn:
+            await conn.run_sync(migrate_database)
     except Exception as e:
         print(f"⚠️ Migration warning: {e}")
 
     # Then create any new tables
-    Base.metadata.create_all(bind=engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    # Trigram indexes so item search (name OR description ILIKE '%q%') can use
+    # a bitmap OR of index scans on PostgreSQL; both columns need one
+    if engine.dialect.name == "postgresql":
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                await conn.execute(
+                    text(
+                        "CREATE INDEX IF NOT EXISTS ix_items_name_trgm "
+                        "ON items USING gin (name gin_trgm_ops)"
+                    )
+                )
+                await conn.execute(
+                    text(
+                        "CREATE INDEX IF NOT EXISTS ix_items_description_trgm "
+                        "ON items USING gin (description gin_trgm_ops)"
+                    )
+                )
+        except Exception as e:
+            print(f"⚠️ Trigram index warning: {e}")
 
 
-def get_db():
+async def get_db():
     """
-    Dependency to get database session.
+    Dependency to get an async database session.
     Usage in FastAPI:
         @app.get("/users")
-        def get_users(db: Session = Depends(get_db)):
-            return db.query(User).all()
+        async def get_users(db: AsyncSession = Depends(get_db)):
+            return (await db.scalars(select(User))).all()
     """
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-def init_demo_data(db):
+async def init_demo_data(db):
     """Initialize database with demo data if empty"""
     # Check if demo user exists
-    demo_user = db.query(User).filter(User.username == "demo").first()
+    demo_user = await db.scalar(select(User).where(User.username == "demo"))
     if not demo_user:
-        import hashlib
-
         # Create demo user
         demo_user = User(
             username="demo",
             email="demo@example.com",
-            password_hash=hashlib.sha256("demo123".encode()).hexdigest(),
+            password_hash=hash_password("demo123"),
             full_name="Demo User",
             is_active=True,
         )
         db.add(demo_user)
-        db.commit()
-        db.refresh(demo_user)
+        await db.commit()
 
         # Create demo posts
         posts = [
@@ -528,20 +612,49 @@ def init_demo_data(db):
             ),
         ]
         db.add_all(posts)
-        db.commit()
+        await db.commit()
 
         print(
             "✅ Demo data initialized (posts only - users create their own sentences)!"
         )
 
+    # Seed the item catalog if empty
+    if not await db.scalar(select(Item.id).limit(1)):
+        db.add_all(
+            [
+                Item(
+                    name="Laptop",
+                    description="High-performance laptop for developers",
+                    price=1299.99,
+                    category="electronics",
+                    in_stock=True,
+                ),
+                Item(
+                    name="Python Cookbook",
+                    description="Advanced Python recipes and techniques",
+                    price=49.99,
+                    category="books",
+                    in_stock=True,
+                ),
+            ]
+        )
+        await db.commit()
+        print("✅ Demo items initialized!")
+
 
 if __name__ == "__main__":
     # Run this file directly to create tables
+    import asyncio
+
     print("Creating database tables...")
-    create_tables()
-    print("✅ Tables created!")
 
-    # Initialize demo data
-    db = SessionLocal()
-    init_demo_data(db)
-    db.close()
+    async def setup():
+        await create_tables()
+        print("✅ Tables created!")
+
+        # Initialize demo data
+        async with SessionLocal() as db:
+            await init_demo_data(db)
+        await engine.dispose()
+
+    asyncio.run(setup())
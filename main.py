@@ -9,20 +9,33 @@ from fastapi import (
     Depends,
     Response,
     Form,
+    Cookie,
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse
+from fastapi.responses import (
+    HTMLResponse,
+    FileResponse,
+    RedirectResponse,
+    ORJSONResponse,
+)
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from fastapi.concurrency import run_in_threadpool
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 from pydantic import BaseModel, Field, EmailStr
 from typing import Optional
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from enum import Enum
-from sqlalchemy.orm import Session as DBSession
+from dataclasses import dataclass, asdict
+from sqlalchemy import select, func, delete, or_
+from sqlalchemy.ext.asyncio import AsyncSession as DBSession
+from sqlalchemy.orm import joinedload, selectinload
 import os
-import shutil
-import uuid
+import asyncio
+import itertools
 import hashlib
+import json
+import orjson
 import secrets
 
 # Import database models and utilities
@@ -38,15 +51,26 @@ from database import (
     PracticeRecord as DBPracticeRecord,
     DailyStreak as DBDailyStreak,
     Payment as DBPayment,
+    Item as DBItem,
     SubscriptionTier,
     PaymentStatus,
     SUBSCRIPTION_LIMITS,
+    DAILY_SENTENCE_LIMITS,
     get_db,
     create_tables,
     init_demo_data,
 )
-from datetime import date
 from dateutil.relativedelta import relativedelta
+from security import (
+    DUMMY_PASSWORD_HASH,
+    hash_password,
+    verify_password,
+    password_needs_rehash,
+)
+from uuid6 import uuid7
+import aiofiles
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
 
 # Initialize FastAPI app with metadata
 app = FastAPI(
@@ -55,18 +79,48 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    # orjson serializes dicts, lists and datetimes several times faster than json
+    default_response_class=ORJSONResponse,
 )
 
 # Create directories for static files and uploads
+UPLOAD_DIR = "static/uploads"
+UPLOAD_URL = f"/{UPLOAD_DIR}"
+# Upload filenames are unique and never rewritten, so clients may cache them forever
+UPLOAD_CACHE_CONTROL = "public, max-age=31536000, immutable"
 os.makedirs("static", exist_ok=True)
-os.makedirs("static/uploads", exist_ok=True)
+os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs("templates", exist_ok=True)
 
-# Mount static files directory
+
+class UploadFiles(StaticFiles):
+    """StaticFiles for uploaded images, adding a long-lived Cache-Control header"""
+
+    async def get_response(self, path: str, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = UPLOAD_CACHE_CONTROL
+        return response
+
+
+# Mount static files directories (uploads first, so its mount takes precedence)
+app.mount(UPLOAD_URL, UploadFiles(directory=UPLOAD_DIR), name="uploads")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Setup Jinja2 templates
-templates = Jinja2Templates(directory="templates")
+# Compiled templates are cached as bytecode on disk so worker restarts skip
+# recompiling; in production (the Dockerfile sets ENVIRONMENT=production) the
+# template files aren't re-checked per render
+ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
+templates = Jinja2Templates(
+    env=Environment(
+        loader=FileSystemLoader("templates"),
+        autoescape=True,
+        bytecode_cache=FileSystemBytecodeCache(),
+        auto_reload=ENVIRONMENT == "development",
+        cache_size=400,
+    )
+)
 
 # CORS middleware configuration
 app.add_middleware(
@@ -82,18 +136,30 @@ SECRET_KEY = os.getenv("SECRET_KEY", secrets.token_hex(32))
 
 
 # ============== Startup Event ==============
+# Schema setup and demo data normally run once via `python database.py` before
+# the server starts; every worker repeating them would race the same DDL.
+# Set RUN_SETUP_ON_STARTUP=1 to run them in-process (single-process dev server).
+RUN_SETUP_ON_STARTUP = os.getenv("RUN_SETUP_ON_STARTUP") == "1"
+
+
 @app.on_event("startup")
-def startup_event():
-    """Initialize database on startup"""
+async def startup_event():
+    """Start background tasks (schema setup runs separately, see database.py)"""
     print("🚀 Starting up...")
-    create_tables()
-    # Initialize demo data
-    db = SessionLocal()
-    try:
-        init_demo_data(db)
-    finally:
-        db.close()
-    print("✅ Database ready!")
+    if RUN_SETUP_ON_STARTUP:
+        await create_tables()
+        async with SessionLocal() as db:
+            await init_demo_data(db)
+    print(f"✅ Database ready! Pool: {engine.pool.status()}")
+
+    # Keep a reference so the task isn't garbage collected
+    app.state.session_gc_task = asyncio.create_task(purge_expired_sessions())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background tasks"""
+    app.state.session_gc_task.cancel()
 
 
 # ============== Enums ==============
@@ -104,6 +170,10 @@ class ItemCategory(str, Enum):
     books = "books"
 
 
+# Category values for the items page filter, built once
+CATEGORY_VALUES = tuple(c.value for c in ItemCategory)
+
+
 # ============== Pydantic Models ==============
 class ItemBase(BaseModel):
     name: str = Field(..., min_length=1, max_length=100, description="Item name")
@@ -182,30 +252,7 @@ class AuthUser(BaseModel):
     created_at: datetime
 
 
-# ============== In-Memory Database (for items only - not auth) ==============
-items_db: dict[int, dict] = {
-    1: {
-        "id": 1,
-        "name": "Laptop",
-        "description": "High-performance laptop for developers",
-        "price": 1299.99,
-        "category": "electronics",
-        "in_stock": True,
-        "created_at": datetime.now(),
-        "image_url": None,
-    },
-    2: {
-        "id": 2,
-        "name": "Python Cookbook",
-        "description": "Advanced Python recipes and techniques",
-        "price": 49.99,
-        "category": "books",
-        "in_stock": True,
-        "created_at": datetime.now(),
-        "image_url": None,
-    },
-}
-
+# ============== In-Memory Database (demo users API only) ==============
 users_db: dict[int, dict] = {
     1: {
         "id": 1,
@@ -216,77 +263,238 @@ users_db: dict[int, dict] = {
     }
 }
 
-item_id_counter = 3
 user_id_counter = 2
 
+# Lowercased email -> user id, so duplicate checks don't scan users_db
+users_by_email: dict[str, int] = {
+    user["email"].lower(): user_id for user_id, user in users_db.items()
+}
+
 
 # ============== Auth Helper Functions ==============
-def hash_password(password: str) -> str:
-    """Hash a password using SHA-256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+# Password hashing lives in security.py, shared with the database setup script
+
+
+def hash_session_token(session_token: str) -> str:
+    """Hash a session token for storage, so a leaked table can't be replayed"""
+    return hashlib.sha256(session_token.encode()).hexdigest()
+
+
+# ============== Redis Cache ==============
+# Optional Redis cache for sessions and per-user data. Without REDIS_URL
+# every lookup goes to the database.
+REDIS_URL = os.getenv("REDIS_URL")
+redis_client = aioredis.from_url(REDIS_URL) if REDIS_URL else None
+
+
+async def cache_get(key: str) -> Optional[bytes]:
+    """Get a value from Redis, or None on a miss (errors count as misses)"""
+    if redis_client is None:
+        return None
+    try:
+        return await redis_client.get(key)
+    except RedisError as e:
+        print(f"⚠️ Redis cache error: {e}")
+        return None
+
+
+async def cache_set(key: str, value: str | bytes, ttl: int):
+    """Store a value in Redis for ttl seconds"""
+    if redis_client is None or ttl <= 0:
+        return
+    try:
+        await redis_client.setex(key, ttl, value)
+    except RedisError as e:
+        print(f"⚠️ Redis cache error: {e}")
+
+
+async def cache_incr(key: str):
+    """Increment a counter in Redis (created at 1 if missing)"""
+    if redis_client is None:
+        return
+    try:
+        await redis_client.incr(key)
+    except RedisError as e:
+        print(f"⚠️ Redis cache error: {e}")
+
+
+async def cache_delete(key: str):
+    """Remove a value from Redis"""
+    if redis_client is None:
+        return
+    try:
+        await redis_client.delete(key)
+    except RedisError as e:
+        print(f"⚠️ Redis cache error: {e}")
+
+
+@dataclass(frozen=True, slots=True)
+class SessionUser:
+    """Identity of the logged in user, as cached for the session and shown on pages"""
 
+    id: int
+    username: str
+    email: str
+    full_name: Optional[str]
+
+
+def _session_cache_key(token_hash: str) -> str:
+    return f"sess:{token_hash}"
+
+
+async def cache_session(token_hash: str, user: SessionUser, ttl: int):
+    """Cache a session's user in Redis for ttl seconds (the session's remaining life)"""
+    await cache_set(_session_cache_key(token_hash), json.dumps(asdict(user)), ttl)
+
+
+async def get_cached_session(token_hash: str) -> Optional[SessionUser]:
+    """Get a session's user from Redis, or None on a miss"""
+    cached = await cache_get(_session_cache_key(token_hash))
+    return SessionUser(**json.loads(cached)) if cached else None
+
+
+async def uncache_session(token_hash: str):
+    """Remove a session from Redis"""
+    await cache_delete(_session_cache_key(token_hash))
 
-def verify_password(password: str, password_hash: str) -> bool:
-    """Verify a password against its hash"""
-    return hash_password(password) == password_hash
 
+# Sessions (and their cookies) last 7 days
+SESSION_TTL = timedelta(days=7)
+SESSION_TTL_SECONDS = int(SESSION_TTL.total_seconds())
+SESSION_GC_INTERVAL = 300  # Seconds between expired-session cleanups
 
-def create_session(db: DBSession, user_id: int, username: str) -> str:
+
+async def create_session(db: DBSession, user: DBUser) -> str:
     """Create a new session in database and return the session token"""
     session_token = secrets.token_urlsafe(32)
-    expires_at = datetime.now() + timedelta(days=7)
+    token_hash = hash_session_token(session_token)
+    expires_at = datetime.now() + SESSION_TTL
 
+    # Only the token's hash is stored; the raw token lives in the cookie
     db_session = DBSessionModel(
-        token=session_token,
-        user_id=user_id,
+        token=token_hash,
+        user_id=user.id,
         expires_at=expires_at,
     )
     db.add(db_session)
-    db.commit()
+    await db.commit()
 
+    await cache_session(
+        token_hash,
+        SessionUser(user.id, user.username, user.email, user.full_name),
+        SESSION_TTL_SECONDS,
+    )
     return session_token
 
 
-def get_session(db: DBSession, session_token: str) -> Optional[DBSessionModel]:
-    """Get session data from token"""
+async def get_session(db: DBSession, session_token: str) -> Optional[SessionUser]:
+    """Get the session's user from token (Redis first, then database)"""
     if not session_token:
         return None
 
-    session = (
-        db.query(DBSessionModel).filter(DBSessionModel.token == session_token).first()
-    )
+    token_hash = hash_session_token(session_token)
+    user = await get_cached_session(token_hash)
+    if user:
+        # The cache entry's TTL ends with the session, so no expiry check needed
+        return user
+
+    row = (
+        await db.execute(
+            select(
+                DBSessionModel.expires_at,
+                DBUser.id,
+                DBUser.username,
+                DBUser.email,
+                DBUser.full_name,
+            )
+            .join(DBUser, DBSessionModel.user_id == DBUser.id)
+            .where(DBSessionModel.token == token_hash)
+        )
+    ).first()
+    if not row:
+        return None
 
-    if session and session.expires_at > datetime.now():
-        return session
-    elif session:
-        # Session expired, remove it
-        db.delete(session)
-        db.commit()
+    expires_at, *identity = row
+    remaining = int((expires_at - datetime.now()).total_seconds())
+    if remaining <= 0:
+        # Session expired; purge_expired_sessions removes the row
+        return None
 
-    return None
+    user = SessionUser(*identity)
+    await cache_session(token_hash, user, remaining)
+    return user
 
 
-def get_current_user(request: Request, db: DBSession) -> Optional[DBUser]:
-    """Get current user from session cookie"""
-    session_token = request.cookies.get("session_token")
+async def purge_expired_sessions():
+    """Background task deleting expired sessions in bulk every few minutes"""
+    while True:
+        await asyncio.sleep(SESSION_GC_INTERVAL)
+        try:
+            async with SessionLocal() as db:
+                result = await db.execute(
+                    delete(DBSessionModel).where(
+                        DBSessionModel.expires_at <= datetime.now()
+                    )
+                )
+                await db.commit()
+            if result.rowcount:
+                print(f"🧹 Removed {result.rowcount} expired sessions")
+        except Exception as e:
+            print(f"⚠️ Session cleanup failed: {e}")
+
+
+async def current_user(
+    session_token: Optional[str] = Cookie(None),
+    db: DBSession = Depends(get_db),
+) -> Optional[SessionUser]:
+    """
+    Dependency returning the logged in user from the session cookie, or None.
+    FastAPI caches dependency results, so the session lookup runs once per request
+    even when several dependencies (require_user, current_db_user) need it.
+    """
     if not session_token:
         return None
+    return await get_session(db, session_token)
+
 
-    session = get_session(db, session_token)
-    if not session:
+async def require_user(
+    user: Optional[SessionUser] = Depends(current_user),
+) -> SessionUser:
+    """Dependency returning the logged in user, or raising 401"""
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return user
+
+
+async def current_db_user(
+    user: Optional[SessionUser] = Depends(current_user),
+    db: DBSession = Depends(get_db),
+) -> Optional[DBUser]:
+    """
+    Dependency returning the logged in user's database row, or None.
+    For handlers that need subscription or streak state, or modify the user.
+    """
+    if not user:
         return None
+    # Streak is joined in so practice endpoints don't need a second query
+    return await db.get(DBUser, user.id, options=[joinedload(DBUser.streak)])
 
-    return db.query(DBUser).filter(DBUser.id == session.user_id).first()
 
+async def require_db_user(
+    user: Optional[DBUser] = Depends(current_db_user),
+) -> DBUser:
+    """Dependency returning the logged in user's database row, or raising 401"""
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return user
 
-def delete_session(db: DBSession, session_token: str):
-    """Delete a session from database"""
-    session = (
-        db.query(DBSessionModel).filter(DBSessionModel.token == session_token).first()
-    )
-    if session:
-        db.delete(session)
-        db.commit()
+
+async def delete_session(db: DBSession, session_token: str):
+    """Delete a session from Redis and the database"""
+    token_hash = hash_session_token(session_token)
+    await uncache_session(token_hash)
+    await db.execute(delete(DBSessionModel).where(DBSessionModel.token == token_hash))
+    await db.commit()
 
 
 # ============== Auth Page Endpoints ==============
@@ -295,10 +503,9 @@ async def login_page(
     request: Request,
     error: Optional[str] = None,
     message: Optional[str] = None,
-    db: DBSession = Depends(get_db),
+    user: Optional[SessionUser] = Depends(current_user),
 ):
     """Login page"""
-    user = get_current_user(request, db)
     if user:
         return RedirectResponse(url="/", status_code=302)
 
@@ -317,10 +524,9 @@ async def login_page(
 async def signup_page(
     request: Request,
     error: Optional[str] = None,
-    db: DBSession = Depends(get_db),
+    user: Optional[SessionUser] = Depends(current_user),
 ):
     """Signup page"""
-    user = get_current_user(request, db)
     if user:
         return RedirectResponse(url="/", status_code=302)
 
@@ -344,14 +550,25 @@ async def login(
 ):
     """Process login form"""
     # Find user in database
-    user = db.query(DBUser).filter(DBUser.username == username).first()
-
-    if not user or not verify_password(password, user.password_hash):
+    user = await db.scalar(select(DBUser).where(DBUser.username == username))
+
+    # scrypt is deliberately slow, so keep it off the event loop. Unknown
+    # usernames are checked against a dummy hash so they take as long.
+    password_ok = await run_in_threadpool(
+        verify_password,
+        password,
+        user.password_hash if user else DUMMY_PASSWORD_HASH,
+    )
+    if not user or not password_ok:
         return RedirectResponse(
             url="/login?error=Invalid username or password",
             status_code=302,
         )
 
+    # Upgrade legacy SHA-256 hashes now that we know the password
+    if password_needs_rehash(user.password_hash):
+        user.password_hash = await run_in_threadpool(hash_password, password)
+
     if not user.is_active:
         return RedirectResponse(
             url="/login?error=Account is disabled",
@@ -359,7 +576,7 @@ async def login(
         )
 
     # Create session in database
-    session_token = create_session(db, user.id, username)
+    session_token = await create_session(db, user)
 
     # Redirect to home with session cookie
     response = RedirectResponse(url="/", status_code=302)
@@ -367,7 +584,7 @@ async def login(
         key="session_token",
         value=session_token,
         httponly=True,
-        max_age=7 * 24 * 60 * 60,  # 7 days
+        max_age=SESSION_TTL_SECONDS,
         samesite="lax",
     )
     return response
@@ -383,17 +600,27 @@ async def signup(
     db: DBSession = Depends(get_db),
 ):
     """Process signup form"""
-    # Check if username exists
-    existing_user = db.query(DBUser).filter(DBUser.username == username).first()
-    if existing_user:
+    # Check if username or email is taken (one query; both columns are uniquely indexed)
+    taken = (
+        (
+            await db.execute(
+                select(DBUser.username).where(
+                    or_(DBUser.username == username, DBUser.email == email)
+                )
+            )
+        )
+        .scalars()
+        .all()
+    )
+
+    if username in taken:
         return RedirectResponse(
             url="/signup?error=Username already exists",
             status_code=302,
         )
 
-    # Check if email exists
-    existing_email = db.query(DBUser).filter(DBUser.email == email).first()
-    if existing_email:
+    if taken:
+        # Any other match is on the email
         return RedirectResponse(
             url="/signup?error=Email already registered",
             status_code=302,
@@ -410,12 +637,12 @@ async def signup(
     new_user = DBUser(
         username=username,
         email=email,
-        password_hash=hash_password(password),
+        password_hash=await run_in_threadpool(hash_password, password),
         full_name=full_name or username,
         is_active=True,
     )
     db.add(new_user)
-    db.commit()
+    await db.commit()
 
     return RedirectResponse(
         url="/login?message=Account created successfully! Please login.",
@@ -428,7 +655,7 @@ async def logout(request: Request, db: DBSession = Depends(get_db)):
     """Logout and clear session"""
     session_token = request.cookies.get("session_token")
     if session_token:
-        delete_session(db, session_token)
+        await delete_session(db, session_token)
 
     response = RedirectResponse(
         url="/login?message=Logged out successfully", status_code=302
@@ -438,52 +665,36 @@ async def logout(request: Request, db: DBSession = Depends(get_db)):
 
 
 @app.get("/profile", response_class=HTMLResponse, tags=["Auth Pages"])
-async def profile_page(request: Request, db: DBSession = Depends(get_db)):
+async def profile_page(
+    request: Request, user: Optional[DBUser] = Depends(current_db_user)
+):
     """User profile page"""
-    user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/login", status_code=302)
 
-    # Convert SQLAlchemy model to dict for template
-    user_dict = {
-        "id": user.id,
-        "username": user.username,
-        "email": user.email,
-        "full_name": user.full_name,
-        "is_active": user.is_active,
-        "created_at": user.created_at,
-    }
-
+    # Jinja reads the model's attributes directly, no dict copy needed
     return templates.TemplateResponse(
         "profile.html",
         {
             "request": request,
             "title": "Profile",
-            "user": user_dict,
+            "user": user,
         },
     )
 
 
 # ============== HTML Page Endpoints ==============
 @app.get("/", response_class=HTMLResponse, tags=["Pages"])
-async def home_page(request: Request, db: DBSession = Depends(get_db)):
+async def home_page(
+    request: Request, user: Optional[SessionUser] = Depends(current_user)
+):
     """Home page with HTML template"""
-    user = get_current_user(request, db)
-    user_dict = None
-    if user:
-        user_dict = {
-            "id": user.id,
-            "username": user.username,
-            "email": user.email,
-            "full_name": user.full_name,
-        }
-
     return templates.TemplateResponse(
         "index.html",
         {
             "request": request,
             "title": "English Speaking Practice",
-            "user": user_dict,
+            "user": user,
         },
     )
 
@@ -493,21 +704,13 @@ async def items_page(
     request: Request,
     category: Optional[str] = None,
     db: DBSession = Depends(get_db),
+    user: Optional[SessionUser] = Depends(current_user),
 ):
     """Items listing page with optional category filter"""
-    user = get_current_user(request, db)
-    user_dict = None
-    if user:
-        user_dict = {
-            "id": user.id,
-            "username": user.username,
-            "email": user.email,
-            "full_name": user.full_name,
-        }
-
-    items = list(items_db.values())
+    query = select(DBItem).order_by(DBItem.id)
     if category:
-        items = [item for item in items if item["category"] == category]
+        query = query.where(DBItem.category == category)
+    items = (await db.scalars(query)).all()
 
     return templates.TemplateResponse(
         "items.html",
@@ -515,55 +718,35 @@ async def items_page(
             "request": request,
             "title": "Items Catalog",
             "items": items,
-            "categories": [c.value for c in ItemCategory],
+            "categories": CATEGORY_VALUES,
             "selected_category": category,
-            "user": user_dict,
+            "user": user,
         },
     )
 
 
 @app.get("/practice", response_class=HTMLResponse, tags=["Pages"])
-async def practice_page(request: Request, db: DBSession = Depends(get_db)):
+async def practice_page(
+    request: Request,
+    db: DBSession = Depends(get_db),
+    user: Optional[DBUser] = Depends(current_db_user),
+):
     """English speaking practice page"""
-    user = get_current_user(request, db)
     user_dict = None
     if user:
         tier = user.current_tier
-        limits = SUBSCRIPTION_LIMITS[tier]
+        daily_limit = DAILY_SENTENCE_LIMITS[tier]
         user_dict = {
             "id": user.id,
             "username": user.username,
             "email": user.email,
             "full_name": user.full_name,
-            "is_premium": user.is_premium,
-            "tier_limits": (
-                limits["daily_sentences"] if limits["daily_sentences"] > 0 else 999999
-            ),
+            "is_premium": tier != SubscriptionTier.FREE,
+            "tier_limits": daily_limit if daily_limit > 0 else 999999,
         }
 
-    # Get sentences from database - only user's own sentences
-    if user:
-        sentences = (
-            db.query(DBSentence)
-            .filter(DBSentence.user_id == user.id)
-            .order_by(DBSentence.id)
-            .all()
-        )
-    else:
-        # Non-logged-in users see no sentences
-        sentences = []
-
-    sentences_list = [
-        {
-            "id": s.id,
-            "chinese": s.chinese,
-            "english": s.english,
-            "hint": s.hint,
-            "category": s.category or "general",
-            "difficulty": s.difficulty or 1,
-        }
-        for s in sentences
-    ]
+    # Get sentences - only user's own sentences; non-logged-in users see none
+    sentences_list = await get_user_sentences(db, user.id) if user else []
 
     return templates.TemplateResponse(
         "practice.html",
@@ -577,51 +760,55 @@ async def practice_page(request: Request, db: DBSession = Depends(get_db)):
 
 
 @app.get("/community", response_class=HTMLResponse, tags=["Pages"])
-async def community_page(request: Request, db: DBSession = Depends(get_db)):
+async def community_page(
+    request: Request,
+    db: DBSession = Depends(get_db),
+    user: Optional[SessionUser] = Depends(current_user),
+):
     """Community posts page"""
-    user = get_current_user(request, db)
-    user_dict = None
-    if user:
-        user_dict = {
-            "id": user.id,
-            "username": user.username,
-            "email": user.email,
-            "full_name": user.full_name,
-        }
-
     # Get posts from database with author info
-    posts = db.query(DBPost).order_by(DBPost.created_at.desc()).all()
-    posts_list = []
-    for post in posts:
-        # Get likes for this post by current user
-        liked_by_current_user = False
-        if user:
-            like = (
-                db.query(DBPostLike)
-                .filter(DBPostLike.post_id == post.id, DBPostLike.user_id == user.id)
-                .first()
-            )
-            liked_by_current_user = like is not None
-
-        posts_list.append(
-            {
-                "id": post.id,
-                "author": post.author_user.username,
-                "author_name": post.author_user.full_name or post.author_user.username,
-                "content": post.content,
-                "created_at": post.created_at,
-                "likes": post.likes,
-                "liked_by_current_user": liked_by_current_user,
-            }
+    posts = (
+        await db.scalars(
+            select(DBPost)
+            .options(selectinload(DBPost.author_user))
+            .order_by(DBPost.created_at.desc())
+        )
+    ).all()
+
+    # Fetch the current user's likes for all listed posts in one query
+    liked_ids = set()
+    if user and posts:
+        liked_ids = set(
+            (
+                await db.scalars(
+                    select(DBPostLike.post_id).where(
+                        DBPostLike.user_id == user.id,
+                        DBPostLike.post_id.in_([post.id for post in posts]),
+                    )
+                )
+            ).all()
         )
 
+    posts_list = [
+        {
+            "id": post.id,
+            "author": post.author_user.username,
+            "author_name": post.author_user.full_name or post.author_user.username,
+            "content": post.content,
+            "created_at": post.created_at,
+            "likes": post.likes,
+            "liked_by_current_user": post.id in liked_ids,
+        }
+        for post in posts
+    ]
+
     return templates.TemplateResponse(
         "community.html",
         {
             "request": request,
             "title": "Community",
             "posts": posts_list,
-            "user": user_dict,
+            "user": user,
         },
     )
 
@@ -634,7 +821,13 @@ class PostCreate(BaseModel):
 @app.get("/api/posts", tags=["API - Community"])
 async def get_posts(db: DBSession = Depends(get_db)):
     """Get all community posts"""
-    posts = db.query(DBPost).order_by(DBPost.created_at.desc()).all()
+    posts = (
+        await db.scalars(
+            select(DBPost)
+            .options(selectinload(DBPost.author_user))
+            .order_by(DBPost.created_at.desc())
+        )
+    ).all()
     return [
         {
             "id": post.id,
@@ -650,14 +843,11 @@ async def get_posts(db: DBSession = Depends(get_db)):
 
 @app.post("/api/posts", tags=["API - Community"])
 async def create_post(
-    request: Request,
     post: PostCreate,
     db: DBSession = Depends(get_db),
+    user: SessionUser = Depends(require_user),
 ):
     """Create a new community post"""
-    user = get_current_user(request, db)
-    if not user:
-        raise HTTPException(status_code=401, detail="You must be logged in to post")
 
     new_post = DBPost(
         author_id=user.id,
@@ -665,8 +855,8 @@ async def create_post(
         likes=0,
     )
     db.add(new_post)
-    db.commit()
-    db.refresh(new_post)
+    await db.commit()
+    await db.refresh(new_post)
 
     return {
         "id": new_post.id,
@@ -680,55 +870,47 @@ async def create_post(
 
 @app.post("/api/posts/{post_id}/like", tags=["API - Community"])
 async def like_post(
-    request: Request,
     post_id: int,
     db: DBSession = Depends(get_db),
+    user: SessionUser = Depends(require_user),
 ):
     """Like or unlike a post"""
-    user = get_current_user(request, db)
-    if not user:
-        raise HTTPException(
-            status_code=401, detail="You must be logged in to like posts"
-        )
 
-    post = db.query(DBPost).filter(DBPost.id == post_id).first()
+    post = await db.get(DBPost, post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
     # Check if user already liked this post
-    existing_like = (
-        db.query(DBPostLike)
-        .filter(DBPostLike.post_id == post_id, DBPostLike.user_id == user.id)
-        .first()
+    existing_like = await db.scalar(
+        select(DBPostLike).where(
+            DBPostLike.post_id == post_id, DBPostLike.user_id == user.id
+        )
     )
 
     if existing_like:
         # Unlike
-        db.delete(existing_like)
+        await db.delete(existing_like)
         post.likes = max(0, post.likes - 1)
-        db.commit()
+        await db.commit()
         return {"liked": False, "likes": post.likes}
     else:
         # Like
         new_like = DBPostLike(post_id=post_id, user_id=user.id)
         db.add(new_like)
         post.likes += 1
-        db.commit()
+        await db.commit()
         return {"liked": True, "likes": post.likes}
 
 
 @app.delete("/api/posts/{post_id}", tags=["API - Community"])
 async def delete_post(
-    request: Request,
     post_id: int,
     db: DBSession = Depends(get_db),
+    user: SessionUser = Depends(require_user),
 ):
     """Delete a post (only author can delete)"""
-    user = get_current_user(request, db)
-    if not user:
-        raise HTTPException(status_code=401, detail="You must be logged in")
 
-    post = db.query(DBPost).filter(DBPost.id == post_id).first()
+    post = await db.get(DBPost, post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
@@ -737,116 +919,147 @@ async def delete_post(
             status_code=403, detail="You can only delete your own posts"
         )
 
-    db.delete(post)
-    db.commit()
+    await db.delete(post)
+    await db.commit()
     return {"message": "Post deleted successfully"}
 
 
 # ============== Image Upload Endpoints ==============
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+ALLOWED_IMAGE_TYPES = frozenset({"image/jpeg", "image/png", "image/gif", "image/webp"})
+ALLOWED_IMAGE_TYPES_MSG = ", ".join(sorted(ALLOWED_IMAGE_TYPES))
+
+# Upload names must be unguessable: /images/{filename} can be fetched and
+# deleted without logging in. A per-process prefix plus a counter keeps names
+# unique; the random part per name keeps them from being enumerated.
+_upload_prefix = secrets.token_hex(4)
+_upload_counter = itertools.count()
+
+
+def unique_upload_name() -> str:
+    """Return a unique, unguessable token for an uploaded file's name"""
+    return f"{_upload_prefix}{next(_upload_counter):x}-{secrets.token_urlsafe(8)}"
+
+
+async def save_upload(file: UploadFile, file_path: str) -> int:
+    """Stream an uploaded file to disk without blocking the event loop"""
+    written = 0
+    async with aiofiles.open(file_path, "wb") as buffer:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await buffer.write(chunk)
+            written += len(chunk)
+    return written
+
+
 @app.post("/upload/image", response_model=ImageUploadResponse, tags=["Images"])
 async def upload_image(file: UploadFile = File(...)):
     """Upload an image file"""
     # Validate file type
-    allowed_types = ["image/jpeg", "image/png", "image/gif", "image/webp"]
-    if file.content_type not in allowed_types:
+    if file.content_type not in ALLOWED_IMAGE_TYPES:
         raise HTTPException(
             status_code=400,
-            detail=f"Invalid file type. Allowed types: {', '.join(allowed_types)}",
+            detail=f"Invalid file type. Allowed types: {ALLOWED_IMAGE_TYPES_MSG}",
         )
 
     # Generate unique filename
     file_ext = os.path.splitext(file.filename)[1]
-    unique_filename = f"{uuid.uuid4()}{file_ext}"
-    file_path = f"static/uploads/{unique_filename}"
-
-    # Save file
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    unique_filename = f"{unique_upload_name()}{file_ext}"
+    file_path = f"{UPLOAD_DIR}/{unique_filename}"
 
-    # Get file size
-    file_size = os.path.getsize(file_path)
+    # Save file (the byte count comes from the copy, no stat needed)
+    file_size = await save_upload(file, file_path)
 
     return ImageUploadResponse(
         filename=unique_filename,
-        url=f"/static/uploads/{unique_filename}",
+        url=f"{UPLOAD_URL}/{unique_filename}",
         size=file_size,
     )
 
 
 @app.post("/items/{item_id}/image", tags=["Images"])
 async def upload_item_image(
-    item_id: int = Path(..., gt=0), file: UploadFile = File(...)
+    item_id: int = Path(..., gt=0),
+    file: UploadFile = File(...),
+    db: DBSession = Depends(get_db),
 ):
     """Upload an image for a specific item"""
-    if item_id not in items_db:
+    item = await db.get(DBItem, item_id)
+    if not item:
         raise HTTPException(status_code=404, detail=f"Item with id {item_id} not found")
 
     # Validate file type
-    allowed_types = ["image/jpeg", "image/png", "image/gif", "image/webp"]
-    if file.content_type not in allowed_types:
+    if file.content_type not in ALLOWED_IMAGE_TYPES:
         raise HTTPException(
             status_code=400,
-            detail=f"Invalid file type. Allowed types: {', '.join(allowed_types)}",
+            detail=f"Invalid file type. Allowed types: {ALLOWED_IMAGE_TYPES_MSG}",
         )
 
     # Generate unique filename
     file_ext = os.path.splitext(file.filename)[1]
-    unique_filename = f"item_{item_id}_{uuid.uuid4()}{file_ext}"
-    file_path = f"static/uploads/{unique_filename}"
+    unique_filename = f"item_{item_id}_{unique_upload_name()}{file_ext}"
+    file_path = f"{UPLOAD_DIR}/{unique_filename}"
 
     # Save file
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    await save_upload(file, file_path)
 
     # Update item with image URL
-    items_db[item_id]["image_url"] = f"/static/uploads/{unique_filename}"
+    item.image_url = f"{UPLOAD_URL}/{unique_filename}"
+    await db.commit()
 
     return {
         "message": "Image uploaded successfully",
-        "image_url": items_db[item_id]["image_url"],
+        "image_url": item.image_url,
     }
 
 
+# The image endpoints below only touch the filesystem, so they are plain
+# def handlers: FastAPI runs them in the threadpool, off the event loop
 @app.get("/images/{filename}", tags=["Images"])
-async def get_image(filename: str):
+def get_image(filename: str):
     """Get an uploaded image by filename"""
-    file_path = f"static/uploads/{filename}"
-    if not os.path.exists(file_path):
+    file_path = f"{UPLOAD_DIR}/{filename}"
+    try:
+        stat_result = os.stat(file_path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Image not found")
-    return FileResponse(file_path)
+    # Hand over the stat so FileResponse doesn't stat the file again
+    return FileResponse(
+        file_path,
+        stat_result=stat_result,
+        headers={"Cache-Control": UPLOAD_CACHE_CONTROL},
+    )
 
 
 @app.delete("/images/{filename}", response_model=Message, tags=["Images"])
-async def delete_image(filename: str):
+def delete_image(filename: str):
     """Delete an uploaded image"""
-    file_path = f"static/uploads/{filename}"
-    if not os.path.exists(file_path):
+    try:
+        os.remove(f"{UPLOAD_DIR}/{filename}")
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Image not found")
 
-    os.remove(file_path)
     return {"message": f"Image {filename} deleted successfully"}
 
 
 # ============== API Health Check ==============
+# Probed constantly by load balancers, so the body is encoded once. A fresh
+# Response is still built per call: middleware (CORS) mutates response headers
+# in place, so a shared instance would accumulate them.
+HEALTH_BODY = b'{"message":"OK"}'
+
+
 @app.get("/api/health", response_model=Message, tags=["API"])
 async def health_check():
     """Health check endpoint"""
-    return {"message": "OK"}
+    return Response(content=HEALTH_BODY, media_type="application/json")
 
 
 # ============== Auth API Endpoints ==============
 @app.get("/api/auth/me", tags=["API - Auth"])
-async def get_current_user_api(request: Request, db: DBSession = Depends(get_db)):
+async def get_current_user_api(user: SessionUser = Depends(require_user)):
     """Get current logged in user"""
-    user = get_current_user(request, db)
-    if not user:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    return {
-        "id": user.id,
-        "username": user.username,
-        "email": user.email,
-        "full_name": user.full_name,
-    }
+    # SessionUser already has exactly the public fields (id, username, email, full_name)
+    return user
 
 
 # ============== Item API Endpoints ==============
@@ -856,72 +1069,80 @@ async def get_items(
     limit: int = Query(10, ge=1, le=100, description="Number of items to return"),
     category: Optional[ItemCategory] = Query(None, description="Filter by category"),
     in_stock: Optional[bool] = Query(None, description="Filter by stock status"),
+    db: DBSession = Depends(get_db),
 ):
     """Get all items with optional filtering and pagination"""
-    items = list(items_db.values())
+    query = select(DBItem)
 
     # Apply filters
     if category:
-        items = [item for item in items if item["category"] == category.value]
+        query = query.where(DBItem.category == category.value)
     if in_stock is not None:
-        items = [item for item in items if item["in_stock"] == in_stock]
+        query = query.where(DBItem.in_stock == in_stock)
 
     # Apply pagination
-    return items[skip : skip + limit]
+    return (await db.scalars(query.order_by(DBItem.id).offset(skip).limit(limit))).all()
 
 
 @app.get("/api/items/{item_id}", response_model=Item, tags=["API - Items"])
 async def get_item(
-    item_id: int = Path(..., gt=0, description="The ID of the item to retrieve")
+    item_id: int = Path(..., gt=0, description="The ID of the item to retrieve"),
+    db: DBSession = Depends(get_db),
 ):
     """Get a specific item by ID"""
-    if item_id not in items_db:
+    item = await db.get(DBItem, item_id)
+    if not item:
         raise HTTPException(status_code=404, detail=f"Item with id {item_id} not found")
-    return items_db[item_id]
+    return item
 
 
 @app.post("/api/items", response_model=Item, status_code=201, tags=["API - Items"])
-async def create_item(item: ItemCreate):
+async def create_item(item: ItemCreate, db: DBSession = Depends(get_db)):
     """Create a new item"""
-    global item_id_counter
-
-    new_item = {
-        "id": item_id_counter,
-        **item.model_dump(),
-        "category": item.category.value,
-        "created_at": datetime.now(),
-        "image_url": None,
-    }
-    items_db[item_id_counter] = new_item
-    item_id_counter += 1
+    new_item = DBItem(
+        **item.model_dump(exclude={"category"}), category=item.category.value
+    )
+    db.add(new_item)
+    await db.commit()
+    await cache_delete(STATS_CACHE_KEY)
 
     return new_item
 
 
 @app.put("/api/items/{item_id}", response_model=Item, tags=["API - Items"])
-async def update_item(item_id: int = Path(..., gt=0), item_update: ItemUpdate = None):
+async def update_item(
+    item_id: int = Path(..., gt=0),
+    item_update: ItemUpdate = None,
+    db: DBSession = Depends(get_db),
+):
     """Update an existing item"""
-    if item_id not in items_db:
+    stored_item = await db.get(DBItem, item_id)
+    if not stored_item:
         raise HTTPException(status_code=404, detail=f"Item with id {item_id} not found")
 
-    stored_item = items_db[item_id]
     update_data = item_update.model_dump(exclude_unset=True)
 
     # Convert category enum to string if present
     if "category" in update_data and update_data["category"]:
         update_data["category"] = update_data["category"].value
 
-    stored_item.update(update_data)
+    for field, value in update_data.items():
+        setattr(stored_item, field, value)
+    await db.commit()
+    await cache_delete(STATS_CACHE_KEY)
     return stored_item
 
 
 @app.delete("/api/items/{item_id}", response_model=Message, tags=["API - Items"])
-async def delete_item(item_id: int = Path(..., gt=0)):
+async def delete_item(item_id: int = Path(..., gt=0), db: DBSession = Depends(get_db)):
     """Delete an item"""
-    if item_id not in items_db:
+    item = await db.get(DBItem, item_id)
+    if not item:
         raise HTTPException(status_code=404, detail=f"Item with id {item_id} not found")
 
-    del items_db[item_id]
+    await db.delete(item)
+    await db.commit()
+    await cache_delete(STATS_CACHE_KEY)
     return {"message": f"Item {item_id} deleted successfully"}
 
 
@@ -933,12 +1154,12 @@ async def get_users(
     active_only: bool = Query(False, description="Return only active users"),
 ):
     """Get all users with optional filtering"""
-    users = list(users_db.values())
-
+    users = users_db.values()
     if active_only:
-        users = [user for user in users if user["is_active"]]
+        users = (user for user in users if user["is_active"])
 
-    return users[skip : skip + limit]
+    # Materialize only the requested page
+    return list(itertools.islice(users, skip, skip + limit))
 
 
 @app.get("/api/users/{user_id}", response_model=UserModel, tags=["API - Users"])
@@ -957,12 +1178,13 @@ async def create_user(user: UserCreate):
     global user_id_counter
 
     # Check for duplicate email
-    for existing_user in users_db.values():
-        if existing_user["email"] == user.email:
-            raise HTTPException(status_code=400, detail="Email already registered")
+    email_key = user.email.lower()
+    if email_key in users_by_email:
+        raise HTTPException(status_code=400, detail="Email already registered")
 
     new_user = {"id": user_id_counter, **user.model_dump(), "is_active": True}
     users_db[user_id_counter] = new_user
+    users_by_email[email_key] = user_id_counter
     user_id_counter += 1
 
     return new_user
@@ -974,7 +1196,8 @@ async def delete_user(user_id: int = Path(..., gt=0)):
     if user_id not in users_db:
         raise HTTPException(status_code=404, detail=f"User with id {user_id} not found")
 
-    del users_db[user_id]
+    removed = users_db.pop(user_id)
+    users_by_email.pop(removed["email"].lower(), None)
     return {"message": f"User {user_id} deleted successfully"}
 
 
@@ -983,23 +1206,74 @@ async def delete_user(user_id: int = Path(..., gt=0)):
 async def search_items(
     q: str = Query(..., min_length=1, description="Search query"),
     category: Optional[ItemCategory] = None,
+    db: DBSession = Depends(get_db),
 ):
-    """Search items by name or description"""
-    results = []
-    query_lower = q.lower()
-
-    for item in items_db.values():
-        if category and item["category"] != category.value:
-            continue
-        if query_lower in item["name"].lower() or (
-            item["description"] and query_lower in item["description"].lower()
-        ):
-            results.append(item)
+    """Search items by name or description (case-insensitive substring match)"""
+    # Escape LIKE wildcards so the query is matched literally
+    escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    pattern = f"%{escaped}%"
+
+    query = select(DBItem).where(
+        or_(
+            DBItem.name.ilike(pattern, escape="\\"),
+            DBItem.description.ilike(pattern, escape="\\"),
+        )
+    )
+    if category:
+        query = query.where(DBItem.category == category.value)
 
+    results = [
+        Item.model_validate(item)
+        for item in (await db.scalars(query.order_by(DBItem.id))).all()
+    ]
     return {"query": q, "count": len(results), "results": results}
 
 
 # ============== Sentence API Endpoints ==============
+# A user's sentence list changes only through the endpoints below, which bump
+# the user's version counter. Cached lists are stored under the version read
+# before querying, so a slow reader can't write an old list back as current.
+SENTENCES_CACHE_TTL = 600
+
+
+def _sentences_version_key(user_id: int) -> str:
+    return f"sentences_version:{user_id}"
+
+
+def _sentences_cache_key(user_id: int, version: int) -> str:
+    return f"sentences:{user_id}:{version}"
+
+
+async def get_user_sentences(db: DBSession, user_id: int) -> list[dict]:
+    """Get a user's sentences (cached in Redis when available)"""
+    version = int(await cache_get(_sentences_version_key(user_id)) or 0)
+    cache_key = _sentences_cache_key(user_id, version)
+    cached = await cache_get(cache_key)
+    if cached:
+        return json.loads(cached)
+
+    sentences = (
+        await db.scalars(
+            select(DBSentence)
+            .where(DBSentence.user_id == user_id)
+            .order_by(DBSentence.id)
+        )
+    ).all()
+    sentences_list = [
+        {
+            "id": s.id,
+            "chinese": s.chinese,
+            "english": s.english,
+            "hint": s.hint,
+            "category": s.category or "general",
+            "difficulty": s.difficulty or 1,
+        }
+        for s in sentences
+    ]
+    await cache_set(cache_key, json.dumps(sentences_list), SENTENCES_CACHE_TTL)
+    return sentences_list
+
+
 class SentenceCreate(BaseModel):
     chinese: str = Field(..., min_length=1)
     hint: Optional[str] = None
@@ -1007,50 +1281,31 @@ class SentenceCreate(BaseModel):
 
 @app.get("/api/sentences", tags=["API - Sentences"])
 async def get_sentences(
-    request: Request,
     category: Optional[str] = None,
     difficulty: Optional[int] = None,
     db: DBSession = Depends(get_db),
+    user: SessionUser = Depends(require_user),
 ):
     """Get user's practice sentences with optional filtering"""
-    user = get_current_user(request, db)
-    if not user:
-        raise HTTPException(
-            status_code=401, detail="You must be logged in to view sentences"
-        )
 
-    # Build query - only return sentences owned by this user
-    query = db.query(DBSentence).filter(DBSentence.user_id == user.id)
+    # Only return sentences owned by this user; filter the cached list
+    sentences = await get_user_sentences(db, user.id)
 
     if category:
-        query = query.filter(DBSentence.category == category)
+        sentences = [s for s in sentences if s["category"] == category]
     if difficulty:
-        query = query.filter(DBSentence.difficulty == difficulty)
+        sentences = [s for s in sentences if s["difficulty"] == difficulty]
 
-    sentences = query.order_by(DBSentence.id).all()
-    return [
-        {
-            "id": s.id,
-            "chinese": s.chinese,
-            "english": s.english,
-            "hint": s.hint,
-            "category": s.category or "general",
-            "difficulty": s.difficulty or 1,
-        }
-        for s in sentences
-    ]
+    return sentences
 
 
 @app.post("/api/sentences", tags=["API - Sentences"])
 async def create_sentence(
-    request: Request, sentence: SentenceCreate, db: DBSession = Depends(get_db)
+    sentence: SentenceCreate,
+    db: DBSession = Depends(get_db),
+    user: SessionUser = Depends(require_user),
 ):
     """Add a new practice sentence"""
-    user = get_current_user(request, db)
-    if not user:
-        raise HTTPException(
-            status_code=401, detail="You must be logged in to add sentences"
-        )
 
     # Create new sentence (ID will be auto-generated)
     new_sentence = DBSentence(
@@ -1061,8 +1316,9 @@ async def create_sentence(
         category="general",  # Default category
     )
     db.add(new_sentence)
-    db.commit()
-    db.refresh(new_sentence)
+    await db.commit()
+    await db.refresh(new_sentence)
+    await cache_incr(_sentences_version_key(user.id))
 
     return {
         "id": new_sentence.id,
@@ -1073,20 +1329,17 @@ async def create_sentence(
 
 @app.delete("/api/sentences/{sentence_id}", tags=["API - Sentences"])
 async def delete_sentence(
-    request: Request, sentence_id: int, db: DBSession = Depends(get_db)
+    sentence_id: int,
+    db: DBSession = Depends(get_db),
+    user: SessionUser = Depends(require_user),
 ):
     """Delete a practice sentence (only user's own sentences)"""
-    user = get_current_user(request, db)
-    if not user:
-        raise HTTPException(
-            status_code=401, detail="You must be logged in to delete sentences"
-        )
 
     # Only allow deleting own sentences
-    sentence = (
-        db.query(DBSentence)
-        .filter(DBSentence.id == sentence_id, DBSentence.user_id == user.id)
-        .first()
+    sentence = await db.scalar(
+        select(DBSentence).where(
+            DBSentence.id == sentence_id, DBSentence.user_id == user.id
+        )
     )
     if not sentence:
         raise HTTPException(
@@ -1094,8 +1347,9 @@ async def delete_sentence(
             detail=f"Sentence with id {sentence_id} not found or you don't have permission",
         )
 
-    db.delete(sentence)
-    db.commit()
+    await db.delete(sentence)
+    await db.commit()
+    await cache_incr(_sentences_version_key(user.id))
     return {"message": f"Sentence {sentence_id} deleted successfully"}
 
 
@@ -1109,31 +1363,24 @@ class PracticeRecordCreate(BaseModel):
 @app.post("/api/practice/record", tags=["API - Practice Stats"])
 async def record_practice(
     record: PracticeRecordCreate,
-    request: Request,
     db: DBSession = Depends(get_db),
+    user: DBUser = Depends(require_db_user),
 ):
     """Record that a user practiced a sentence today with their answer"""
-    user = get_current_user(request, db)
-    if not user:
-        raise HTTPException(
-            status_code=401, detail="You must be logged in to track practice"
-        )
 
     today = date.today()
 
     # Check daily limit for free users
-    tier = user.current_tier
-    limits = SUBSCRIPTION_LIMITS[tier]
-    daily_limit = limits["daily_sentences"]
+    daily_limit = DAILY_SENTENCE_LIMITS[user.current_tier]
 
     # Count unique sentences practiced today
-    today_count = (
-        db.query(DBPracticeRecord)
-        .filter(
+    today_count = await db.scalar(
+        select(func.count())
+        .select_from(DBPracticeRecord)
+        .where(
             DBPracticeRecord.user_id == user.id,
             DBPracticeRecord.practice_date == today,
         )
-        .count()
     )
 
     if daily_limit > 0:  # -1 means unlimited
@@ -1149,14 +1396,12 @@ async def record_practice(
             )
 
     # Check if already recorded today for this sentence
-    existing = (
-        db.query(DBPracticeRecord)
-        .filter(
+    existing = await db.scalar(
+        select(DBPracticeRecord).where(
             DBPracticeRecord.user_id == user.id,
             DBPracticeRecord.sentence_id == record.sentence_id,
             DBPracticeRecord.practice_date == today,
         )
-        .first()
     )
 
     if existing:
@@ -1172,24 +1417,17 @@ async def record_practice(
         else:
             existing.mastery_level = max((existing.mastery_level or 0) - 1, 0)
 
-        db.commit()
-
-        return {
+        response = {
             "message": "Practice updated",
             "date": str(today),
             "today_count": today_count,
             "total_practiced": (
-                db.query(DBDailyStreak)
-                .filter(DBDailyStreak.user_id == user.id)
-                .first()
-                .total_sentences_practiced
-                if db.query(DBDailyStreak)
-                .filter(DBDailyStreak.user_id == user.id)
-                .first()
-                else 0
+                user.streak.total_sentences_practiced if user.streak else 0
             ),
             "mastery_level": existing.mastery_level,
         }
+        await db.commit()
+        return response
 
     # Create new practice record
     new_record = DBPracticeRecord(
@@ -1203,11 +1441,17 @@ async def record_practice(
     )
     db.add(new_record)
 
-    # Update or create streak
-    streak = db.query(DBDailyStreak).filter(DBDailyStreak.user_id == user.id).first()
+    # Update or create streak (loaded alongside the user)
+    streak = user.streak
     if not streak:
-        streak = DBDailyStreak(user_id=user.id)
-        db.add(streak)
+        # Column defaults only apply on INSERT, so start the counters explicitly
+        streak = DBDailyStreak(
+            current_streak=0,
+            longest_streak=0,
+            total_practice_days=0,
+            total_sentences_practiced=0,
+        )
+        user.streak = streak
 
     # Update streak statistics
     streak.total_sentences_practiced += 1
@@ -1234,92 +1478,78 @@ async def record_practice(
 
         streak.last_practice_date = today
 
-    db.commit()
-
-    return {
+    response = {
         "message": "Practice recorded",
         "date": str(today),
         "today_count": today_count + 1,
         "total_practiced": streak.total_sentences_practiced,
         "mastery_level": new_record.mastery_level,
     }
+    await db.commit()
+    return response
 
 
 @app.get("/api/practice/stats", tags=["API - Practice Stats"])
 async def get_practice_stats(
-    request: Request,
     db: DBSession = Depends(get_db),
+    user: DBUser = Depends(require_db_user),
 ):
     """Get user's practice statistics"""
-    user = get_current_user(request, db)
-    if not user:
-        raise HTTPException(
-            status_code=401, detail="You must be logged in to view stats"
-        )
 
     today = date.today()
 
     # Get streak info
-    streak = db.query(DBDailyStreak).filter(DBDailyStreak.user_id == user.id).first()
-
-    # Get today's practice count
-    today_count = (
-        db.query(DBPracticeRecord)
-        .filter(
-            DBPracticeRecord.user_id == user.id,
-            DBPracticeRecord.practice_date == today,
-        )
-        .count()
-    )
+    streak = user.streak
 
-    # Get practiced sentence IDs for today
-    today_practiced = (
-        db.query(DBPracticeRecord.sentence_id)
-        .filter(
-            DBPracticeRecord.user_id == user.id,
-            DBPracticeRecord.practice_date == today,
+    # Get practiced sentence IDs for today (their count is today's practice count)
+    today_sentence_ids = (
+        await db.scalars(
+            select(DBPracticeRecord.sentence_id).where(
+                DBPracticeRecord.user_id == user.id,
+                DBPracticeRecord.practice_date == today,
+            )
         )
-        .all()
-    )
-    today_sentence_ids = [r[0] for r in today_practiced]
+    ).all()
+    today_count = len(today_sentence_ids)
 
     # Get mastered count
-    mastered_count = (
-        db.query(DBPracticeRecord)
-        .filter(
+    mastered_count = await db.scalar(
+        select(func.count())
+        .select_from(DBPracticeRecord)
+        .where(
             DBPracticeRecord.user_id == user.id,
             DBPracticeRecord.is_mastered == True,
         )
-        .count()
     )
 
     # Get total sentences
-    total_sentences = db.query(DBSentence).count()
+    total_sentences = await db.scalar(select(func.count()).select_from(DBSentence))
 
     # Get daily limit
-    tier = user.current_tier
-    limits = SUBSCRIPTION_LIMITS[tier]
-    daily_limit = limits["daily_sentences"]
-
-    # Get practice history for last 7 days
-    from datetime import timedelta
-
-    history = []
-    for i in range(6, -1, -1):
-        day = today - timedelta(days=i)
-        count = (
-            db.query(DBPracticeRecord)
-            .filter(
-                DBPracticeRecord.user_id == user.id,
-                DBPracticeRecord.practice_date == day,
+    daily_limit = DAILY_SENTENCE_LIMITS[user.current_tier]
+
+    # Get practice history for last 7 days (one GROUP BY instead of a query per day)
+    week_start = today - timedelta(days=6)
+    daily_counts = dict(
+        (
+            await db.execute(
+                select(DBPracticeRecord.practice_date, func.count())
+                .where(
+                    DBPracticeRecord.user_id == user.id,
+                    DBPracticeRecord.practice_date >= week_start,
+                )
+                .group_by(DBPracticeRecord.practice_date)
             )
-            .count()
-        )
+        ).all()
+    )
+    history = []
+    for i in range(7):
+        day = week_start + timedelta(days=i)
         history.append(
             {
                 "date": str(day),
                 "day_name": day.strftime("%a"),
-                "count": count,
+                "count": daily_counts.get(day, 0),
             }
         )
 
@@ -1341,84 +1571,123 @@ async def get_practice_stats(
 
 @app.get("/api/practice/history", tags=["API - Practice Stats"])
 async def get_practice_history(
-    request: Request,
     limit: int = Query(10, ge=1, le=100),
     db: DBSession = Depends(get_db),
+    user: SessionUser = Depends(require_user),
 ):
     """Get user's recent practice history with sentence details"""
-    user = get_current_user(request, db)
-    if not user:
-        raise HTTPException(
-            status_code=401, detail="You must be logged in to view history"
-        )
 
-    # Get recent practice records with sentence details
-    records = (
-        db.query(DBPracticeRecord)
-        .filter(
-            DBPracticeRecord.user_id == user.id,
+    # Get recent practice records joined with their sentence in a single query
+    rows = (
+        await db.execute(
+            select(DBPracticeRecord, DBSentence)
+            .outerjoin(DBSentence, DBSentence.id == DBPracticeRecord.sentence_id)
+            .where(DBPracticeRecord.user_id == user.id)
+            .order_by(DBPracticeRecord.updated_at.desc())
+            .limit(limit)
         )
-        .order_by(DBPracticeRecord.updated_at.desc())
-        .limit(limit)
-        .all()
-    )
+    ).all()
 
     # Build response with sentence info
-    history = []
-    for record in records:
-        sentence = (
-            db.query(DBSentence).filter(DBSentence.id == record.sentence_id).first()
-        )
-        history.append(
-            {
-                "id": record.id,
-                "sentence_id": record.sentence_id,
-                "chinese": sentence.chinese if sentence else "Unknown",
-                "english": sentence.english if sentence else "",
-                "user_answer": record.user_answer,
-                "mastery_level": record.mastery_level or 0,
-                "is_mastered": record.is_mastered or False,
-                "is_bookmarked": record.is_bookmarked or False,
-                "practice_count": record.practice_count or 1,
-                "practice_date": str(record.practice_date),
-                "updated_at": (
-                    record.updated_at.isoformat() if record.updated_at else None
-                ),
-            }
-        )
-
-    return history
+    return [
+        {
+            "id": record.id,
+            "sentence_id": record.sentence_id,
+            "chinese": sentence.chinese if sentence else "Unknown",
+            "english": sentence.english if sentence else "",
+            "user_answer": record.user_answer,
+            "mastery_level": record.mastery_level or 0,
+            "is_mastered": record.is_mastered or False,
+            "is_bookmarked": record.is_bookmarked or False,
+            "practice_count": record.practice_count or 1,
+            "practice_date": str(record.practice_date),
+            "updated_at": (
+                record.updated_at.isoformat() if record.updated_at else None
+            ),
+        }
+        for record, sentence in rows
+    ]
 
 
 # ============== Stats Endpoint ==============
-@app.get("/api/stats", tags=["API - Statistics"])
-async def get_stats(db: DBSession = Depends(get_db)):
-    """Get statistics about the data"""
-    items = list(items_db.values())
+STATS_CACHE_CONTROL = "public, max-age=60"
+# The encoded stats are shared through Redis for as long as clients may cache
+# them; item writes drop the entry, user and post counts catch up on expiry
+STATS_CACHE_KEY = "stats"
+STATS_CACHE_TTL = 60
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header (a list of weak or strong tags, or *)"""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+async def compute_stats(db: DBSession) -> bytes:
+    """Aggregate the stats and encode them as JSON with sorted keys"""
+    # Item aggregates are computed in SQL, one row per category
+    category_rows = (
+        await db.execute(
+            select(
+                DBItem.category,
+                func.count(),
+                func.count().filter(DBItem.in_stock.is_(True)),
+                func.sum(DBItem.price),
+            ).group_by(DBItem.category)
+        )
+    ).all()
 
     category_counts = {}
-    for item in items:
-        cat = item["category"]
-        category_counts[cat] = category_counts.get(cat, 0) + 1
-
-    in_stock_count = sum(1 for item in items if item["in_stock"])
-
-    # Get user count from database
-    user_count = db.query(DBUser).count()
-    post_count = db.query(DBPost).count()
+    total_items = in_stock_count = 0
+    total_price = 0.0
+    for cat, count, stocked, price_sum in category_rows:
+        category_counts[cat] = count
+        total_items += count
+        in_stock_count += stocked
+        total_price += price_sum
+
+    # User and post counts in one round trip
+    user_count, post_count = (
+        await db.execute(
+            select(
+                select(func.count()).select_from(DBUser).scalar_subquery(),
+                select(func.count()).select_from(DBPost).scalar_subquery(),
+            )
+        )
+    ).one()
 
-    return {
-        "total_items": len(items),
+    stats = {
+        "total_items": total_items,
         "total_users": user_count,
         "total_posts": post_count,
         "items_in_stock": in_stock_count,
-        "items_out_of_stock": len(items) - in_stock_count,
+        "items_out_of_stock": total_items - in_stock_count,
         "items_by_category": category_counts,
-        "average_price": (
-            round(sum(item["price"] for item in items) / len(items), 2) if items else 0
-        ),
+        "average_price": round(total_price / total_items, 2) if total_items else 0,
     }
 
+    return orjson.dumps(stats, option=orjson.OPT_SORT_KEYS)
+
+
+@app.get("/api/stats", tags=["API - Statistics"])
+async def get_stats(request: Request, db: DBSession = Depends(get_db)):
+    """Get statistics about the data (conditional GET via ETag)"""
+    body = await cache_get(STATS_CACHE_KEY)
+    if body is None:
+        body = await compute_stats(db)
+        await cache_set(STATS_CACHE_KEY, body, STATS_CACHE_TTL)
+
+    etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": STATS_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 
 # ============== Subscription & Payment Endpoints ==============
 
@@ -1433,6 +1702,16 @@ ALIPAY_RETURN_URL = os.getenv(
     "ALIPAY_RETURN_URL", "http://localhost:8000/payment/success"
 )
 
+PRICING_CACHE_CONTROL = "public, max-age=300"
+
+# Display names for subscription tiers
+TIER_NAMES = {
+    SubscriptionTier.FREE: "免费版",
+    SubscriptionTier.BASIC: "基础版",
+    SubscriptionTier.PREMIUM: "高级版",
+    SubscriptionTier.LIFETIME: "终身会员",
+}
+
 # Pricing configuration
 PRICING = {
     "basic_monthly": {
@@ -1469,36 +1748,41 @@ PRICING = {
 
 
 @app.get("/api/subscription/status", tags=["API - Subscription"])
-async def get_subscription_status(request: Request, db: DBSession = Depends(get_db)):
+async def get_subscription_status(
+    db: DBSession = Depends(get_db),
+    session_user: SessionUser = Depends(require_user),
+):
     """Get current user's subscription status"""
-    user = get_current_user(request, db)
-    if not user:
-        raise HTTPException(status_code=401, detail="Not authenticated")
 
-    # Get today's practice count for limit check
-    today = date.today()
-    today_count = (
-        db.query(DBPracticeRecord)
-        .filter(
-            DBPracticeRecord.user_id == user.id,
-            DBPracticeRecord.practice_date == today,
+    # Load the user and today's practice count (for the limit check) in one
+    # SELECT; the count is a subquery correlated to the user row
+    today_count_subquery = (
+        select(func.count())
+        .select_from(DBPracticeRecord)
+        .where(
+            DBPracticeRecord.user_id == DBUser.id,
+            DBPracticeRecord.practice_date == date.today(),
         )
-        .count()
+        .scalar_subquery()
     )
+    row = (
+        await db.execute(
+            select(DBUser, today_count_subquery).where(DBUser.id == session_user.id)
+        )
+    ).first()
+    if not row:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    user, today_count = row
 
+    # Resolve the tier once; is_premium would re-run the same expiry check
     tier = user.current_tier
     limits = SUBSCRIPTION_LIMITS[tier]
-    daily_limit = limits["daily_sentences"]
+    daily_limit = DAILY_SENTENCE_LIMITS[tier]
 
     return {
         "tier": tier.value,
-        "tier_name": {
-            "free": "免费版",
-            "basic": "基础版",
-            "premium": "高级版",
-            "lifetime": "终身会员",
-        }.get(tier.value, tier.value),
-        "is_premium": user.is_premium,
+        "tier_name": TIER_NAMES.get(tier, tier.value),
+        "is_premium": tier != SubscriptionTier.FREE,
         "lifetime_member": user.lifetime_member,
         "expires_at": (
             user.subscription_expires_at.isoformat()
@@ -1520,8 +1804,10 @@ async def get_subscription_status(request: Request, db: DBSession = Depends(get_
 
 
 @app.get("/api/subscription/pricing", tags=["API - Subscription"])
-async def get_pricing():
+async def get_pricing(response: Response):
     """Get subscription pricing options"""
+    # Pricing is static, so browsers and proxies may reuse it
+    response.headers["Cache-Control"] = PRICING_CACHE_CONTROL
     return {
         "plans": [
             {
@@ -1608,22 +1894,19 @@ async def get_pricing():
 
 @app.post("/api/payment/create", tags=["API - Payment"])
 async def create_payment(
-    request: Request,
     plan_id: str = Query(..., description="Plan ID from pricing"),
     db: DBSession = Depends(get_db),
+    user: SessionUser = Depends(require_user),
 ):
     """Create a payment order for subscription"""
-    user = get_current_user(request, db)
-    if not user:
-        raise HTTPException(status_code=401, detail="Not authenticated")
 
     if plan_id not in PRICING:
         raise HTTPException(status_code=400, detail="Invalid plan ID")
 
     plan = PRICING[plan_id]
 
-    # Generate unique order ID
-    order_id = f"ESP{datetime.now().strftime('%Y%m%d%H%M%S')}{user.id}{secrets.token_hex(4).upper()}"
+    # Generate unique order ID (UUIDv7 is time-ordered, so inserts stay index-friendly)
+    order_id = uuid7().hex.upper()
 
     # Create payment record
     payment = DBPayment(
@@ -1635,7 +1918,7 @@ async def create_payment(
         status=PaymentStatus.PENDING.value,
     )
     db.add(payment)
-    db.commit()
+    await db.commit()
 
     # Generate Alipay payment URL
     # In production, use actual Alipay SDK
@@ -1675,7 +1958,7 @@ async def payment_notify(request: Request, db: DBSession = Depends(get_db)):
         return "fail"
 
     # Find payment record
-    payment = db.query(DBPayment).filter(DBPayment.order_id == order_id).first()
+    payment = await db.scalar(select(DBPayment).where(DBPayment.order_id == order_id))
     if not payment:
         return "fail"
 
@@ -1683,10 +1966,12 @@ async def payment_notify(request: Request, db: DBSession = Depends(get_db)):
     if trade_status in ["TRADE_SUCCESS", "TRADE_FINISHED"]:
         payment.status = PaymentStatus.COMPLETED.value
         payment.alipay_trade_no = alipay_trade_no
-        payment.paid_at = datetime.utcnow()
+        # Read the clock once so paid_at and the new expiry agree
+        now = datetime.utcnow()
+        payment.paid_at = now
 
         # Update user subscription
-        user = db.query(DBUser).filter(DBUser.id == payment.user_id).first()
+        user = await db.get(DBUser, payment.user_id)
         if user:
             if payment.months == 0:  # Lifetime
                 user.lifetime_member = True
@@ -1694,10 +1979,7 @@ async def payment_notify(request: Request, db: DBSession = Depends(get_db)):
             else:
                 user.subscription_tier = payment.subscription_tier
                 # Extend or set expiration
-                if (
-                    user.subscription_expires_at
-                    and user.subscription_expires_at > datetime.utcnow()
-                ):
+                if user.subscription_expires_at and user.subscription_expires_at > now:
                     # Extend existing subscription
                     user.subscription_expires_at = (
                         user.subscription_expires_at
@@ -1705,11 +1987,11 @@ async def payment_notify(request: Request, db: DBSession = Depends(get_db)):
                     )
                 else:
                     # New subscription
-                    user.subscription_expires_at = datetime.utcnow() + relativedelta(
+                    user.subscription_expires_at = now + relativedelta(
                         months=payment.months
                     )
 
-        db.commit()
+        await db.commit()
         return "success"
 
     return "fail"
@@ -1718,21 +2000,16 @@ async def payment_notify(request: Request, db: DBSession = Depends(get_db)):
 @app.get("/api/payment/check/{order_id}", tags=["API - Payment"])
 async def check_payment(
     order_id: str,
-    request: Request,
     db: DBSession = Depends(get_db),
+    user: SessionUser = Depends(require_user),
 ):
     """Check payment status"""
-    user = get_current_user(request, db)
-    if not user:
-        raise HTTPException(status_code=401, detail="Not authenticated")
 
-    payment = (
-        db.query(DBPayment)
-        .filter(
+    payment = await db.scalar(
+        select(DBPayment).where(
             DBPayment.order_id == order_id,
             DBPayment.user_id == user.id,
         )
-        .first()
     )
 
     if not payment:
@@ -1750,21 +2027,16 @@ async def check_payment(
 @app.post("/api/payment/demo-complete/{order_id}", tags=["API - Payment"])
 async def demo_complete_payment(
     order_id: str,
-    request: Request,
     db: DBSession = Depends(get_db),
+    user: DBUser = Depends(require_db_user),
 ):
     """[DEMO ONLY] Simulate successful payment - REMOVE IN PRODUCTION"""
-    user = get_current_user(request, db)
-    if not user:
-        raise HTTPException(status_code=401, detail="Not authenticated")
 
-    payment = (
-        db.query(DBPayment)
-        .filter(
+    payment = await db.scalar(
+        select(DBPayment).where(
             DBPayment.order_id == order_id,
             DBPayment.user_id == user.id,
         )
-        .first()
     )
 
     if not payment:
@@ -1776,7 +2048,8 @@ async def demo_complete_payment(
     # Complete payment
     payment.status = PaymentStatus.COMPLETED.value
     payment.alipay_trade_no = f"DEMO_{secrets.token_hex(8)}"
-    payment.paid_at = datetime.utcnow()
+    now = datetime.utcnow()
+    payment.paid_at = now
 
     # Update user subscription
     if payment.months == 0:  # Lifetime
@@ -1784,19 +2057,14 @@ async def demo_complete_payment(
         user.subscription_tier = SubscriptionTier.LIFETIME.value
     else:
         user.subscription_tier = payment.subscription_tier
-        if (
-            user.subscription_expires_at
-            and user.subscription_expires_at > datetime.utcnow()
-        ):
+        if user.subscription_expires_at and user.subscription_expires_at > now:
             user.subscription_expires_at = user.subscription_expires_at + relativedelta(
                 months=payment.months
             )
         else:
-            user.subscription_expires_at = datetime.utcnow() + relativedelta(
-                months=payment.months
-            )
+            user.subscription_expires_at = now + relativedelta(months=payment.months)
 
-    db.commit()
+    await db.commit()
 
     return {
         "message": "Payment completed successfully (DEMO)",
@@ -1811,9 +2079,10 @@ async def demo_complete_payment(
 
 # ============== Pricing Page ==============
 @app.get("/pricing", response_class=HTMLResponse, tags=["Pages"])
-async def pricing_page(request: Request, db: DBSession = Depends(get_db)):
+async def pricing_page(
+    request: Request, user: Optional[DBUser] = Depends(current_db_user)
+):
     """Pricing page"""
-    user = get_current_user(request, db)
     user_dict = None
     subscription_info = None
 
@@ -1848,9 +2117,9 @@ async def payment_success_page(
     request: Request,
     out_trade_no: str = Query(None),
     db: DBSession = Depends(get_db),
+    user: Optional[DBUser] = Depends(current_db_user),
 ):
     """Payment success page"""
-    user = get_current_user(request, db)
     user_dict = None
     payment_info = None
 
@@ -1863,13 +2132,11 @@ async def payment_success_page(
         }
 
         if out_trade_no:
-            payment = (
-                db.query(DBPayment)
-                .filter(
+            payment = await db.scalar(
+                select(DBPayment).where(
                     DBPayment.order_id == out_trade_no,
                     DBPayment.user_id == user.id,
                 )
-                .first()
             )
             if payment:
                 payment_info = {
@@ -1892,4 +2159,6 @@ async def payment_success_page(
 if __name__ == "__main__":
     import uvicorn
 
+    # Single dev server, so it can set up the database itself
+    os.environ.setdefault("RUN_SETUP_ON_STARTUP", "1")
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
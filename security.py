@@ -0,0 +1,46 @@
+"""
+Password hashing shared by the app and the database setup script.
+Passwords are stored as salted scrypt hashes; unsalted SHA-256 hashes from
+older databases are still accepted and upgraded on the next login.
+"""
+
+import hashlib
+import hmac
+import secrets
+
+# scrypt cost parameters (N=2^14, r=8 uses 16 MiB per hash)
+SCRYPT_N = 2**14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+
+def hash_password(password: str) -> str:
+    """Hash a password using scrypt with a random salt"""
+    salt = secrets.token_bytes(16)
+    digest = hashlib.scrypt(
+        password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P
+    )
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    """Verify a password against its hash (scrypt, or legacy unsalted SHA-256)"""
+    if not password_hash.startswith("scrypt$"):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, password_hash)
+
+    _, n, r, p, salt, digest = password_hash.split("$")
+    candidate = hashlib.scrypt(
+        password.encode(), salt=bytes.fromhex(salt), n=int(n), r=int(r), p=int(p)
+    )
+    return hmac.compare_digest(candidate, bytes.fromhex(digest))
+
+
+def password_needs_rehash(password_hash: str) -> bool:
+    """Check if a stored hash predates the current scrypt parameters"""
+    return not password_hash.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+
+# Checked against when the username doesn't exist, so a failed login costs the
+# same scrypt work either way and response time doesn't reveal valid usernames
+DUMMY_PASSWORD_HASH = hash_password(secrets.token_urlsafe(16))